@@ -29,7 +29,7 @@ function app() {
         itemsPerPage: 50,
         maxDepth: 2,
         useThreads: true,
-        maxWorkers: 4,
+        maxWorkers: 32,
         toasts: [],
         modalOpen: false,
         modalMessage: '',
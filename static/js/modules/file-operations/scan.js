@@ -82,7 +82,7 @@ window.oneDriveScanOperations = {
                 per_page: appData.itemsPerPage || 50,
                 max_depth: appData.maxDepth || 2,
                 use_threads: appData.useThreads !== undefined ? appData.useThreads : true,
-                max_workers: appData.maxWorkers || 4
+                max_workers: appData.maxWorkers || 32
             });
             
             // Include threading parameters in the API call
@@ -1,13 +1,19 @@
 import os
+import json
 import flask
-from flask import jsonify, request
-import humanize
+from flask import jsonify, request, current_app
+import orjson
+import hashlib
+import time
 from datetime import datetime
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from .file_analyzer import DirectoryScanner, is_onedrive_cloud_only
+from .file_analyzer import DirectoryScanner, is_onedrive_cloud_only, get_file_changes, format_timestamp
 from .onedrive_utils import make_file_cloud_only
-from .config import get_onedrive_path, update_onedrive_path
-from .database import get_scan_results, store_scan_results
+from .config import get_onedrive_path, update_onedrive_path, get_default_max_workers
+from .database import get_db, get_active_scan, get_scan_results, store_scan_results, update_scan_files, decode_cursor, format_file_size
+from .usn_journal import query_journal_cursor, read_changed_files
 
 # Global variable to track scan status
 scan_status = {
@@ -21,19 +27,119 @@ scan_status = {
 
 # Reset the scan status if the app restarts
 def reset_scan_status():
-    global scan_status
-    scan_status = {
-        'status': 'Idle',
-        'progress': 0,
-        'current_directory': '',
-        'files_processed': 0,
-        'total_estimate': 100,
-        'last_updated': datetime.now()
-    }
+    """Reset the scan status in place, so every holder of the dict sees the reset"""
+    scan_status.update(
+        status='Idle',
+        progress=0,
+        current_directory='',
+        files_processed=0,
+        total_estimate=100,
+        last_updated=time.monotonic()
+    )
+    scan_status.pop('time_elapsed', None)
 
 # Reset the status on startup
 reset_scan_status()
 
+# How long a stored scan is served from the database before /api/scan rescans
+SCAN_CACHE_TTL_SECONDS = 300
+
+def is_scan_fresh(last_scan_time):
+    """Check whether a stored scan is recent enough to be served from the cache"""
+    if not isinstance(last_scan_time, datetime):
+        return False
+    return (datetime.now() - last_scan_time).total_seconds() <= SCAN_CACHE_TTL_SECONDS
+
+def scan_page_etag(scan_id, revision, page, per_page, sort_by, sort_order, is_cloud_only, search_query, cursor):
+    """Build the ETag identifying one page of a stored scan"""
+    # revision changes whenever the scan is patched in place (journal refresh, freed files)
+    key = f"{scan_id}:{revision}:{page}:{per_page}:{sort_by}:{sort_order}:{is_cloud_only}:{search_query}:{cursor}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+def refresh_scan_from_journal(onedrive_path, active_scan, conn):
+    """
+    Bring a stale stored scan up to date from the NTFS change journal,
+    re-reading only the files that changed since it was taken.
+    Returns False when a full rescan is needed instead.
+    """
+    scan_params = json.loads(active_scan['scan_params'] or '{}')
+    changes = read_changed_files(onedrive_path, scan_params.get('usn_journal'))
+    if changes is None:
+        return False
+    
+    changed_paths, scan_params['usn_journal'] = changes
+    file_updates = [update for update in map(get_file_changes, changed_paths) if update is not None]
+    return update_scan_files(active_scan['id'], file_updates, scan_params, conn=conn)
+
+def record_freed_files(freed_files, conn):
+    """
+    Write the status observed after freeing files into the active stored scan,
+    so pages served from it do not show them as local again
+    Args:
+        freed_files: Iterable of (file_path, is_cloud_only) for the files freed successfully
+        conn: Open database connection
+    """
+    onedrive_path = get_onedrive_path()
+    active_scan = get_active_scan(onedrive_path, conn=conn) if onedrive_path else None
+    if not active_scan:
+        return
+    
+    file_updates = []
+    for file_path, is_cloud_only in freed_files:
+        changes = get_file_changes(file_path)
+        if changes is not None:
+            file_updates.append(changes._replace(is_cloud_only=is_cloud_only))
+    
+    if file_updates:
+        # Only these files were re-read, so the scan keeps its scan_time and still expires
+        update_scan_files(active_scan['id'], file_updates, conn=conn)
+
+def scan_status_etag(status):
+    """Build the ETag of the scan status fields shown by the client"""
+    key = (f"{status['status']}:{status['progress']}:{status['current_directory']}:"
+           f"{status['files_processed']}:{status['total_estimate']}:{status.get('time_elapsed')}")
+    return hashlib.md5(key.encode()).hexdigest()
+
+# Limits for /api/free-multiple
+FREE_MULTIPLE_MAX_PATHS = 1000
+FREE_MULTIPLE_WORKERS = 8
+
+def free_file(file_path):
+    """Make a single file cloud-only and return its /api/free-multiple result entry"""
+    try:
+        if os.path.exists(file_path):
+            # Make file cloud-only using our new function
+            success, message, is_cloud_only = make_file_cloud_only(file_path)
+            
+            return {
+                'path': file_path,
+                'success': success,
+                'message': message,
+                'is_cloud_only': is_cloud_only
+            }
+        return {
+            'path': file_path,
+            'success': False,
+            'message': 'File not found'
+        }
+    except Exception as e:
+        return {
+            'path': file_path,
+            'success': False,
+            'message': str(e)
+        }
+
+def json_response(payload, status=200):
+    """Create a JSON response serialized with orjson, which is much faster than jsonify on large file lists"""
+    return current_app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+def scan_page_response(payload, etag):
+    """Create a JSON response for a scan page that clients can revalidate with its ETag"""
+    response = json_response(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, max-age=5'
+    return response
+
 def init_routes(app):
     """Initialize all API routes for the Flask application"""
     
@@ -75,11 +181,10 @@ def init_routes(app):
     @app.route('/api/scan-status')
     def api_scan_status():
         """API endpoint to get the current scan status"""
-        global scan_status
+        now = time.monotonic()
         
         # If scan hasn't been started or is very old, reset status
-        if scan_status['last_updated'] is None or \
-           (datetime.now() - scan_status['last_updated']).total_seconds() > 300:  # 5 minutes timeout
+        if scan_status['last_updated'] is None or now - scan_status['last_updated'] > 300:  # 5 minutes timeout
             reset_scan_status()
         
         # Calculate percentage progress based on files processed and estimated total
@@ -89,7 +194,7 @@ def init_routes(app):
         
         # Add time elapsed if we're in an active scan
         if scan_status['last_updated'] and scan_status['status'] != 'Idle':
-            time_elapsed = (datetime.now() - scan_status['last_updated']).total_seconds()
+            time_elapsed = now - scan_status['last_updated']
             scan_status['time_elapsed'] = round(time_elapsed)
             
             # If we're scanning but haven't updated status in 10 seconds, mark as possibly stalled
@@ -97,7 +202,18 @@ def init_routes(app):
                 if 'Scanning' in scan_status['status'] or 'Processing' in scan_status['status']:
                     scan_status['status'] = 'Processing... (This may take a while)'
         
-        return jsonify(scan_status)
+        # The ETag covers exactly what the client displays, so polls while nothing
+        # visible changed are answered with an empty 304
+        etag = scan_status_etag(scan_status)
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        response = jsonify(scan_status)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
         
     @app.route('/api/scan-all')
     def api_scan_all():
@@ -115,7 +231,8 @@ def init_routes(app):
         # Scan parameters
         max_depth = request.args.get('max_depth', default=2, type=int)
         use_threads = request.args.get('use_threads', default=True, type=lambda v: v.lower() == 'true')
-        max_workers = request.args.get('max_workers', default=4, type=int)
+        max_workers = request.args.get('max_workers', default=get_default_max_workers(), type=int)
+        max_workers = max(1, min(max_workers, 64))  # Limit worker threads between 1 and 64
         
         # Create a directory scanner with the global scan status
         directory_scanner = DirectoryScanner(scan_status)
@@ -128,24 +245,35 @@ def init_routes(app):
             max_workers=max_workers
         )
         
-        # Calculate statistics for the total set
-        total_files_count = len(files_info)
-        local_files = sum(1 for file in files_info if not file.get('is_cloud_only', False))
-        remote_files = sum(1 for file in files_info if file.get('is_cloud_only', False))
-        total_size = sum(file.get('size', 0) for file in files_info)
-        local_size = sum(file.get('size', 0) for file in files_info if not file.get('is_cloud_only', False))
-        
-        return jsonify({
-            'files': files_info,
+        # Calculate statistics for the total set in a single pass, converting the
+        # scanned tuples to dicts with display sizes at the serialization boundary
+        files = []
+        total_files_count = local_files = remote_files = total_size = local_size = 0
+        for file_info in files_info:
+            size = file_info.size
+            file = file_info._asdict()
+            file['human_size'] = format_file_size(size)
+            file['last_modified'] = format_timestamp(file_info.last_modified) if file_info.last_modified is not None else ''
+            files.append(file)
+            total_files_count += 1
+            total_size += size
+            if file_info.is_cloud_only:
+                remote_files += 1
+            else:
+                local_files += 1
+                local_size += size
+        
+        return json_response({
+            'files': files,
             'stats': {
                 'total_files': total_files_count,
                 'local_files': local_files,
                 'remote_files': remote_files,
                 'total_size': total_size,
-                'human_total_size': humanize.naturalsize(total_size),
+                'human_total_size': format_file_size(total_size),
                 'local_size': local_size,
-                'human_local_size': humanize.naturalsize(local_size),
-                'potential_savings': humanize.naturalsize(local_size)
+                'human_local_size': format_file_size(local_size),
+                'potential_savings': format_file_size(local_size)
             }
         })
 
@@ -167,6 +295,14 @@ def init_routes(app):
         is_cloud_only = request.args.get('is_cloud_only', type=lambda v: v.lower() == 'true')
         search_query = request.args.get('search_query', '')
         
+        # Keyset pagination cursor (pagination.next_cursor of the previous page)
+        cursor = request.args.get('cursor')
+        if cursor and decode_cursor(cursor) is None:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid pagination cursor.'
+            }), 400
+        
         # Get the OneDrive path from config
         onedrive_path = get_onedrive_path()
         
@@ -189,100 +325,102 @@ def init_routes(app):
             'direction': sort_order
         }
         
-        # Check if we need to perform a new scan or can use cached data
-        cached_results = get_scan_results(
-            onedrive_path, 
-            page=page, 
-            per_page=per_page,
-            filters=filters,
-            sort_options=sort_options
-        )
-        
-        # If we have recent cached results and are not forcing a rescan, use them
+        # Get scan parameters
+        max_depth = request.args.get('max_depth', default=2, type=int)
+        use_threads = request.args.get('use_threads', default=True, type=lambda v: v.lower() == 'true')
+        max_workers = request.args.get('max_workers', default=get_default_max_workers(), type=int)
+        max_workers = max(1, min(max_workers, 64))  # Limit worker threads between 1 and 64
         force_rescan = request.args.get('force_rescan', 'false').lower() == 'true'
         
-        if cached_results and not force_rescan:
-            # Add last scan time to the response
+        # Serve the page straight from the database while the last scan is fresh,
+        # so paginating does not walk the whole OneDrive tree again
+        active_scan = None if force_rescan else get_active_scan(onedrive_path, max_depth, conn=get_db())
+        
+        # A stale scan is patched from the change journal where possible, instead of a full rescan
+        if active_scan and not is_scan_fresh(active_scan['scan_time']):
+            if refresh_scan_from_journal(onedrive_path, active_scan, get_db()):
+                active_scan = get_active_scan(onedrive_path, max_depth, conn=get_db())
+        
+        if active_scan and is_scan_fresh(active_scan['scan_time']):
+            etag = scan_page_etag(active_scan['id'], active_scan['revision'], page, per_page, sort_by, sort_order, is_cloud_only, search_query, cursor)
+            
+            # The client already has this page, skip the query and the payload
+            if etag in request.if_none_match:
+                response = app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+            
+            cached_results = get_scan_results(
+                onedrive_path, 
+                page=page, 
+                per_page=per_page,
+                filters=filters,
+                sort_options=sort_options,
+                max_depth=max_depth,
+                cursor=cursor,
+                conn=get_db()
+            )
+            
+            # A failed query is an error, not a reason to walk the whole tree again
+            if not cached_results:
+                return json_response({
+                    'success': False,
+                    'message': 'Failed to read the scan results from the database.'
+                }, status=500)
+            
             cached_results['cache_used'] = True
-            return jsonify(cached_results)
+            return scan_page_response(cached_results, etag)
         
         # Otherwise, perform a new scan
-        # Get scan parameters
-        max_depth = request.args.get('max_depth', default=2, type=int)
-        use_threads = request.args.get('use_threads', default=True, type=lambda v: v.lower() == 'true')
-        max_workers = request.args.get('max_workers', default=4, type=int)
+        # Take the journal position first, so changes made during the walk are seen by the next refresh
+        journal_cursor = query_journal_cursor(onedrive_path)
         
         # Create a directory scanner with the global scan status
         directory_scanner = DirectoryScanner(scan_status)
         
-        # Scan the directory
-        files_info = directory_scanner.scan_directory(
+        # Scan the directory, streaming the files into the database batch by batch
+        # instead of holding the whole tree in memory
+        file_batches = directory_scanner.iter_scan_batches(
             onedrive_path, 
             max_depth, 
             use_threads=use_threads, 
             max_workers=max_workers
         )
         
-        # Apply filters
-        filtered_files = files_info
-        
-        # Filter by cloud-only status if specified
-        if is_cloud_only is not None:
-            filtered_files = [f for f in filtered_files if f['is_cloud_only'] == is_cloud_only]
-        
-        # Sort files
-        if sort_by == 'size':
-            filtered_files.sort(key=lambda x: x['size'], reverse=(sort_order == 'desc'))
-        elif sort_by == 'name':
-            filtered_files.sort(key=lambda x: x['name'], reverse=(sort_order == 'desc'))
-        elif sort_by == 'last_modified':
-            filtered_files.sort(key=lambda x: x['last_modified'], reverse=(sort_order == 'desc'))
-        
-        # Custom sorting to prioritize local files
-        def custom_sort_key(file):
-            return (
-                0 if not file.get('is_cloud_only', False) else 1,
-                -file.get('size', 0)
+        # Store the scan and let the database filter, sort, paginate and aggregate it
+        scan_params = {
+            'use_threads': use_threads,
+            'max_workers': max_workers,
+            'usn_journal': journal_cursor
+        }
+        try:
+            scan_id = store_scan_results(onedrive_path, chain.from_iterable(file_batches), max_depth, scan_params, conn=get_db())
+        finally:
+            # Stops the walk and publishes the final status if storing ended early
+            file_batches.close()
+        
+        results = None
+        if scan_id is not None:
+            results = get_scan_results(
+                onedrive_path, 
+                page=page, 
+                per_page=per_page,
+                filters=filters,
+                sort_options=sort_options,
+                max_depth=max_depth,
+                cursor=cursor,
+                conn=get_db()
             )
         
-        filtered_files.sort(key=custom_sort_key)
-        
-        # Paginate
-        total_files = len(filtered_files)
-        total_pages = (total_files + per_page - 1) // per_page
-        
-        start_index = (page - 1) * per_page
-        end_index = start_index + per_page
-        paginated_files = filtered_files[start_index:end_index]
-        
-        # Calculate statistics for the total set
-        total_files_count = len(files_info)
-        local_files = sum(1 for file in files_info if not file.get('is_cloud_only', False))
-        remote_files = sum(1 for file in files_info if file.get('is_cloud_only', False))
-        total_size = sum(file.get('size', 0) for file in files_info)
-        local_size = sum(file.get('size', 0) for file in files_info if not file.get('is_cloud_only', False))
+        if not results:
+            return json_response({
+                'success': False,
+                'message': 'Failed to store the scan results in the database.'
+            }, status=500)
         
-        return jsonify({
-            'files': paginated_files,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total_files': total_files,
-                'total_pages': total_pages,
-                'has_next': page < total_pages,
-                'has_previous': page > 1
-            },
-            'stats': {
-                'total_files': total_files_count,
-                'local_files': local_files,
-                'remote_files': remote_files,
-                'total_size': total_size,
-                'human_total_size': humanize.naturalsize(total_size),
-                'local_size': local_size,
-                'human_local_size': humanize.naturalsize(local_size),
-                'potential_savings': humanize.naturalsize(local_size)
-            }
-        })
+        results['cache_used'] = False
+        etag = scan_page_etag(results['scan_id'], results['revision'], page, per_page, sort_by, sort_order, is_cloud_only, search_query, cursor)
+        return scan_page_response(results, etag)
 
     @app.route('/api/free-space', methods=['POST'])
     def free_space():
@@ -303,11 +441,10 @@ def init_routes(app):
                     'message': 'File status checked successfully'
                 })
             
-            # Otherwise, try to make the file cloud-only
-            success, message = make_file_cloud_only(file_path)
-            
-            # Double-check the file status after the operation
-            is_cloud_only = is_onedrive_cloud_only(file_path)
+            # Otherwise, try to make the file cloud-only; it reports the status it observed
+            success, message, is_cloud_only = make_file_cloud_only(file_path)
+            if success:
+                record_freed_files([(file_path, is_cloud_only)], get_db())
             
             return jsonify({
                 'success': success,
@@ -323,31 +460,27 @@ def init_routes(app):
     def free_multiple():
         """API endpoint to free up space for multiple files"""
         file_paths = request.json.get('paths', [])
-        results = []
-        
-        for file_path in file_paths:
-            try:
-                if os.path.exists(file_path):
-                    # Make file cloud-only using our new function
-                    success, message = make_file_cloud_only(file_path)
-                    
-                    results.append({
-                        'path': file_path,
-                        'success': success,
-                        'message': message
-                    })
-                else:
-                    results.append({
-                        'path': file_path,
-                        'success': False,
-                        'message': 'File not found'
-                    })
-            except Exception as e:
-                results.append({
-                    'path': file_path,
-                    'success': False,
-                    'message': str(e)
-                })
+        
+        # Bound the work (and memory) a single request can ask for
+        if len(file_paths) > FREE_MULTIPLE_MAX_PATHS:
+            return jsonify({
+                'success': False,
+                'message': f'Too many files in one request (maximum {FREE_MULTIPLE_MAX_PATHS}).'
+            }), 400
+        
+        # Each file is an independent, mostly blocking OneDrive operation, so run them side by side
+        results_by_path = {}
+        with ThreadPoolExecutor(max_workers=FREE_MULTIPLE_WORKERS) as executor:
+            futures = {executor.submit(free_file, file_path): file_path for file_path in file_paths}
+            for future in as_completed(futures):
+                results_by_path[futures[future]] = future.result()
+        
+        # Report the results in the order the files were requested
+        results = [results_by_path[file_path] for file_path in file_paths]
+        record_freed_files(
+            ((r['path'], r['is_cloud_only']) for r in results if r['success']),
+            get_db()
+        )
         
         return jsonify({
             'success': any(r['success'] for r in results),
@@ -11,16 +11,40 @@ DEFAULT_CONFIG = {
     "onedrive_path": "",  # Empty by default, user must configure
     "default_max_depth": 2,
     "default_threads": True,
-    "default_max_workers": 4
+    # Directory listing is I/O bound, so size the pool like ThreadPoolExecutor does for I/O
+    "default_max_workers": min(32, (os.cpu_count() or 4) * 8)
 }
 
 # Config file path
 CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
 
+# Last configuration read from disk and the file modification time it was read at
+_config_cache = None
+_config_mtime = None
+
+def invalidate_config_cache():
+    """Force the next load_config call to read the config file again."""
+    global _config_cache, _config_mtime
+    _config_cache = None
+    _config_mtime = None
+
 def load_config():
-    """Load the configuration from the config file. If the file doesn't exist, create it with default values."""
+    """Load the configuration from the config file. If the file doesn't exist, create it with default values.
+    
+    The parsed file is cached and only re-read when its modification time changes,
+    so frequent callers pay for a stat instead of an open, read and JSON parse.
+    """
+    global _config_cache, _config_mtime
     try:
-        if os.path.exists(CONFIG_FILE):
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        
+        if mtime is not None:
+            if _config_cache is not None and mtime == _config_mtime:
+                return dict(_config_cache)
+            
             with open(CONFIG_FILE, 'r') as f:
                 config = json.load(f)
                 logger.info(f"Configuration loaded from {CONFIG_FILE}")
@@ -29,8 +53,10 @@ def load_config():
                 for key in DEFAULT_CONFIG:
                     if key not in config:
                         config[key] = DEFAULT_CONFIG[key]
-                        
-                return config
+                
+                _config_cache = config
+                _config_mtime = mtime
+                return dict(config)
         else:
             # Create the config file with default values
             with open(CONFIG_FILE, 'w') as f:
@@ -47,6 +73,8 @@ def save_config(config):
         with open(CONFIG_FILE, 'w') as f:
             json.dump(config, f, indent=4)
         logger.info(f"Configuration saved to {CONFIG_FILE}")
+        # The mtime may not change on coarse-grained filesystems, never trust the old copy
+        invalidate_config_cache()
         return True
     except Exception as e:
         logger.error(f"Error saving configuration: {str(e)}")
@@ -62,3 +90,8 @@ def get_onedrive_path():
     """Get the OneDrive path from the configuration."""
     config = load_config()
     return config.get("onedrive_path", "")
+
+def get_default_max_workers():
+    """Get the default number of scan worker threads from the configuration."""
+    config = load_config()
+    return config.get("default_max_workers", DEFAULT_CONFIG["default_max_workers"])
@@ -1,4 +1,4 @@
 """
 Database package initialization
 """
-from .db_manager import get_db, init_db, close_db, get_scan_results, store_scan_results
+from .db_manager import get_db, init_db, close_db, get_active_scan, get_scan_results, store_scan_results, update_scan_files, decode_cursor, format_file_size
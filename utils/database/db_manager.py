@@ -6,10 +6,15 @@ import os
 import sqlite3
 import json
 import time
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta
 from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 from flask import g, current_app
 
+from ..file_analyzer import format_timestamp
+
 # Database file location
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 
                        'data', 'onedrive_cache.db')
@@ -17,30 +22,102 @@ DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.a
 # Ensure the data directory exists
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
+# Secondary indices on scanned_files: (name, definition, rebuild_after_load).
+# Every query filters by scan_id first, so each index leads with it. Those flagged
+# True are dropped while a scan is loaded into an empty table (in practice only the
+# first scan of a new database) and rebuilt afterwards, which is much cheaper than
+# updating them row by row.
+FILE_INDEXES = [
+    # Serves the default "local files first, largest first" order within a scan, and lets
+    # keyset pagination seek straight to the next page of it
+    ('idx_scan_cloud_size_id', 'scanned_files (scan_id, is_cloud_only, size DESC, id DESC)', True),
+    # Finds the rows touched by an incremental refresh from the change journal
+    ('idx_scan_path', 'scanned_files (scan_id, file_path)', True),
+]
+
+# Indices of earlier versions that no query uses any more (idx_scan_id is a prefix of
+# both indices above), dropped so rescans do not have to maintain them
+RETIRED_FILE_INDEXES = (
+    'idx_scan_id',
+    'idx_is_cloud_only',
+    'idx_size',
+    'idx_scan_cloud_size',
+    'idx_scan_size_id',
+)
+
+# Range of the integers SQLite can bind, checked on page cursors
+SQLITE_MIN_INTEGER = -2**63
+SQLITE_MAX_INTEGER = 2**63 - 1
+
+# Number of files stored per write transaction while a scan is being stored
+STORE_BATCH_SIZE = 5000
+
+# Map user-friendly sort column names to database columns
+SORT_COLUMNS = {
+    'size': 'size',
+    'name': 'name',
+    'last_modified': 'last_modified'
+}
+
+# Units used by format_file_size, each 1024 times the previous one
+FILE_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+# (db_column, ORDER BY clause, keyset predicate) for every supported sort, built once.
+# Local files always come first, whatever the column and direction, then id breaks
+# ties so the order is total and a page cursor is unambiguous. The predicate only
+# seeks within the cloud-only status of the last row (column value and id); the rows
+# with a later status are read by a second range scan, see get_scan_results.
+SORT_SQL = {
+    (column, direction): (
+        db_column,
+        f' ORDER BY is_cloud_only ASC, {db_column} {direction.upper()}, id {direction.upper()}',
+        f' AND ({db_column}, id) {"<" if direction == "desc" else ">"} (?, ?)'
+    )
+    for column, db_column in SORT_COLUMNS.items()
+    for direction in ('asc', 'desc')
+}
+
+def connect_db():
+    """Open a database connection with the settings shared by every connection"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        detect_types=sqlite3.PARSE_DECLTYPES
+    )
+    conn.row_factory = sqlite3.Row
+    
+    # WAL (enabled in init_db) only needs a sync at checkpoints with NORMAL,
+    # and temporary b-trees and a 64 MB page cache stay in memory
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
+    return conn
+
 def get_db():
     """Get a database connection"""
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            DB_PATH,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = connect_db()
     
     return g.db
 
 @contextmanager
 def get_db_connection():
     """Context manager for database connections outside of request context"""
-    conn = sqlite3.connect(
-        DB_PATH,
-        detect_types=sqlite3.PARSE_DECLTYPES
-    )
-    conn.row_factory = sqlite3.Row
+    conn = connect_db()
     try:
         yield conn
     finally:
         conn.close()
 
+@contextmanager
+def use_connection(conn=None):
+    """Use the given connection (e.g. the request's get_db()), or open one for this call only"""
+    if conn is not None:
+        yield conn
+        return
+    
+    with get_db_connection() as new_conn:
+        yield new_conn
+
 def close_db(e=None):
     """Close the database connection"""
     db = g.pop('db', None)
@@ -51,6 +128,10 @@ def close_db(e=None):
 def init_db():
     """Initialize the database with necessary tables"""
     with get_db_connection() as conn:
+        # Write-ahead logging lets readers keep going while a scan is being stored.
+        # The journal mode is persistent, so setting it once here is enough.
+        conn.execute('PRAGMA journal_mode=WAL')
+        
         cursor = conn.cursor()
         
         # Create table for scan results
@@ -63,10 +144,16 @@ def init_db():
             scan_params TEXT NOT NULL,
             stats TEXT NOT NULL,
             files_json TEXT,
-            is_active INTEGER DEFAULT 1
+            is_active INTEGER DEFAULT 1,
+            revision INTEGER NOT NULL DEFAULT 0
         )
         ''')
         
+        # Databases created before scans were patched in place lack the revision column
+        scan_columns = {row['name'] for row in conn.execute('PRAGMA table_info(scan_results)')}
+        if 'revision' not in scan_columns:
+            cursor.execute('ALTER TABLE scan_results ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+        
         # Create table for individual files (for better query performance)
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS scanned_files (
@@ -84,84 +171,121 @@ def init_db():
         ''')
         
         # Create indices for faster queries
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_id ON scanned_files (scan_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_is_cloud_only ON scanned_files (is_cloud_only)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_size ON scanned_files (size)')
+        for name in RETIRED_FILE_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+        create_file_indexes(conn)
         
         conn.commit()
+        
+        # Scans left inactive (e.g. by an interrupted store) are never served again
+        clear_old_scans(conn=conn)
+
+def create_file_indexes(conn):
+    """Create any missing secondary indices on scanned_files"""
+    for name, definition, _ in FILE_INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+def delete_scans(conn, where, params):
+    """
+    Delete the scans matching a condition on scan_results, together with their files.
+    The files are deleted explicitly, as foreign keys (and ON DELETE CASCADE) are off.
+    Args:
+        conn: Open database connection, inside the caller's transaction
+        where: SQL condition on scan_results selecting the scans to delete
+        params: Parameters of the condition
+    Returns:
+        Number of scans deleted
+    """
+    conn.execute(
+        f'DELETE FROM scanned_files WHERE scan_id IN (SELECT id FROM scan_results WHERE {where})',
+        params
+    )
+    return conn.execute(f'DELETE FROM scan_results WHERE {where}', params).rowcount
+
+def prepare_file_records(scan_id, files_info):
+    """Yield scanned_files rows for executemany, skipping files that cannot be stored"""
+    for file_info in files_info:
+        try:
+            # The scanner reports epoch seconds; store them in the text form of the
+            # TIMESTAMP column, using the current time when the file could not be read
+            last_modified = file_info.last_modified
+            if last_modified is None:
+                last_modified = time.time()
+            last_modified = format_timestamp(last_modified)
+                
+            yield (
+                scan_id,
+                file_info.path,
+                file_info.name,
+                int(file_info.size),
+                1 if file_info.is_cloud_only else 0,
+                last_modified,
+                file_info.relative_folder_path,
+                file_info.parent_folder
+            )
+        except Exception as e:
+            print(f"Error preparing file record: {e}. File: {file_info.path}")
 
-def store_scan_results(onedrive_path, files_info, stats, max_depth, scan_params):
+def store_scan_results(onedrive_path, files_info, max_depth, scan_params, conn=None):
     """
-    Store scan results in the database
+    Store scan results in the database, computing the scan statistics in SQL.
+    The files are committed STORE_BATCH_SIZE at a time into a scan that stays
+    inactive until all of them are stored, so the write lock is never held while
+    the scanner walks the tree and the previous scan is served in the meantime.
     Args:
         onedrive_path: Path to OneDrive folder
-        files_info: List of file information dictionaries
-        stats: Dictionary with scan statistics
+        files_info: Iterable of FileInfo tuples from the scanner; it is consumed once,
+            so a generator can stream a running scan straight into the table
         max_depth: Maximum scan depth
         scan_params: Dictionary with additional scan parameters
+        conn: Open connection to use (a new one is opened when omitted)
     Returns:
         scan_id: ID of the stored scan
     """
     try:
         # Convert complex objects to JSON for storage
-        stats_json = json.dumps(stats)
         scan_params_json = json.dumps(scan_params)
         
-        with get_db_connection() as conn:
-            # Mark previous scans for this path as inactive
-            conn.execute(
-                'UPDATE scan_results SET is_active = 0 WHERE onedrive_path = ?',
-                (onedrive_path,)
-            )
-            
-            # Insert new scan metadata
-            cursor = conn.execute(
-                '''
-                INSERT INTO scan_results 
-                (onedrive_path, max_depth, scan_time, scan_params, stats, is_active)
-                VALUES (?, ?, ?, ?, ?, 1)
-                ''',
-                (onedrive_path, max_depth, datetime.now(), scan_params_json, stats_json)
-            )
-            scan_id = cursor.lastrowid
-            print(f"Created new scan record with ID: {scan_id}")
-            
-            # Insert file records in batches for better performance
-            batch_size = 100
-            for i in range(0, len(files_info), batch_size):
-                batch = files_info[i:i+batch_size]
+        with use_connection(conn) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Bulk loading without the indices only pays off when they would be
+                # rebuilt over this scan alone, not over the rows of other paths
+                load_without_indexes = conn.execute(
+                    'SELECT NOT EXISTS (SELECT 1 FROM scanned_files)'
+                ).fetchone()[0]
                 
-                # Create a list of tuples for executemany
-                records = []
-                for file_info in batch:
-                    try:
-                        # Ensure we have a valid timestamp for last_modified
-                        last_modified = file_info.get('last_modified')
-                        if isinstance(last_modified, str):
-                            try:
-                                # Try to parse the timestamp string
-                                last_modified = datetime.strptime(last_modified, '%Y-%m-%d %H:%M:%S')
-                            except ValueError:
-                                # If parsing fails, use current time
-                                last_modified = datetime.now()
-                        elif not isinstance(last_modified, datetime):
-                            last_modified = datetime.now()
-                            
-                        records.append((
-                            scan_id,
-                            file_info['path'],
-                            file_info['name'],
-                            int(file_info['size']),
-                            1 if file_info['is_cloud_only'] else 0,
-                            last_modified,
-                            file_info.get('relative_folder_path', ''),
-                            file_info.get('parent_folder', '')
-                        ))
-                    except Exception as e:
-                        print(f"Error preparing file record: {e}. File: {file_info.get('path', 'Unknown')}")
+                # Drop the indices that are cheaper to rebuild than to maintain per row
+                if load_without_indexes:
+                    for name, _, rebuild_after_load in FILE_INDEXES:
+                        if rebuild_after_load:
+                            conn.execute(f'DROP INDEX IF EXISTS {name}')
                 
-                # Insert batch
-                if records:
+                # Insert new scan metadata, inactive until all files are stored
+                cursor = conn.execute(
+                    '''
+                    INSERT INTO scan_results 
+                    (onedrive_path, max_depth, scan_time, scan_params, stats, is_active)
+                    VALUES (?, ?, ?, ?, ?, 0)
+                    ''',
+                    (onedrive_path, max_depth, datetime.now(), scan_params_json, '{}')
+                )
+                scan_id = cursor.lastrowid
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f"Created new scan record with ID: {scan_id}")
+            
+            try:
+                # Each batch is read from the scanner before the write transaction starts
+                files_stored = 0
+                records = prepare_file_records(scan_id, files_info)
+                while True:
+                    batch = list(islice(records, STORE_BATCH_SIZE))
+                    if not batch:
+                        break
+                    conn.execute('BEGIN IMMEDIATE')
                     conn.executemany(
                         '''
                         INSERT INTO scanned_files
@@ -169,18 +293,186 @@ def store_scan_results(onedrive_path, files_info, stats, max_depth, scan_params)
                         relative_folder_path, parent_folder)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                         ''',
-                        records
+                        batch
                     )
-                    print(f"Inserted batch of {len(records)} files")
+                    conn.commit()
+                    files_stored += len(batch)
+                
+                conn.execute('BEGIN IMMEDIATE')
+                if load_without_indexes:
+                    create_file_indexes(conn)
+                
+                # The new scan replaces the previous ones for this path, so drop them
+                # instead of keeping a full copy of the tree for every rescan
+                delete_scans(conn, 'onedrive_path = ? AND id < ?', (onedrive_path, scan_id))
+                
+                # Aggregate the statistics once, so pages served later just read them back
+                stats = compute_scan_stats(conn, scan_id)
+                activated = conn.execute(
+                    'UPDATE scan_results SET stats = ?, is_active = 1 WHERE id = ?',
+                    (json.dumps(stats), scan_id)
+                ).rowcount
+                if not activated:
+                    raise RuntimeError(f"scan {scan_id} was replaced by a newer scan of the same path")
+                
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                
+                # Discard what was stored of the unfinished scan
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('DELETE FROM scanned_files WHERE scan_id = ?', (scan_id,))
+                conn.execute('DELETE FROM scan_results WHERE id = ?', (scan_id,))
+                if load_without_indexes:
+                    create_file_indexes(conn)
+                conn.commit()
+                raise
             
-            conn.commit()
-            print(f"Database commit complete. Total files stored: {len(files_info)}")
+            print(f"Database commit complete. Total files stored: {files_stored}")
             return scan_id
     except Exception as e:
         print(f"Error storing scan results: {e}")
         return None
 
-def get_scan_results(onedrive_path, page=1, per_page=50, filters=None, sort_options=None):
+def update_scan_files(scan_id, file_updates, scan_params=None, conn=None):
+    """
+    Patch a stored scan in place with files re-read after they changed or were freed.
+    Every update bumps the scan's revision, which the page ETags are built from.
+    Args:
+        scan_id: ID of the scan to update
+        file_updates: Iterable of FileChange (or FileInfo) tuples with the new attributes
+        scan_params: Dictionary with the scan parameters to store when the update brings
+            the whole scan up to date (a change journal refresh); this also resets its
+            scan_time. None when only the given files were re-read, e.g. after freeing them.
+        conn: Open connection to use (a new one is opened when omitted)
+    Returns:
+        True if the scan was updated, False otherwise
+    """
+    try:
+        with use_connection(conn) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = conn.executemany(
+                    '''
+                    UPDATE scanned_files
+                    SET size = ?, is_cloud_only = ?, last_modified = ?
+                    WHERE scan_id = ? AND file_path = ?
+                    ''',
+                    ((int(change.size), 1 if change.is_cloud_only else 0,
+                      format_timestamp(change.last_modified), scan_id, change.path)
+                     for change in file_updates)
+                )
+                files_updated = cursor.rowcount
+                
+                stats = compute_scan_stats(conn, scan_id)
+                conn.execute(
+                    'UPDATE scan_results SET stats = ?, revision = revision + 1 WHERE id = ?',
+                    (json.dumps(stats), scan_id)
+                )
+                if scan_params is not None:
+                    conn.execute(
+                        'UPDATE scan_results SET scan_time = ?, scan_params = ? WHERE id = ?',
+                        (datetime.now(), json.dumps(scan_params), scan_id)
+                    )
+                
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            print(f"Updated {files_updated} files of scan {scan_id}")
+            return True
+    except Exception as e:
+        print(f"Error updating scan results: {e}")
+        return False
+
+def compute_scan_stats(conn, scan_id):
+    """
+    Compute the statistics of a stored scan with a single aggregate query
+    Args:
+        conn: Open database connection
+        scan_id: ID of the scan
+    Returns:
+        Dictionary with file counts, sizes and their human-readable forms
+    """
+    row = conn.execute(
+        '''
+        SELECT COUNT(*) AS total_files,
+               COALESCE(SUM(size), 0) AS total_size,
+               COALESCE(SUM(CASE WHEN is_cloud_only = 0 THEN size END), 0) AS local_size,
+               COALESCE(SUM(CASE WHEN is_cloud_only = 0 THEN 1 END), 0) AS local_files
+        FROM scanned_files
+        WHERE scan_id = ?
+        ''',
+        (scan_id,)
+    ).fetchone()
+    
+    return {
+        'total_files': row['total_files'],
+        'local_files': row['local_files'],
+        'remote_files': row['total_files'] - row['local_files'],
+        'total_size': row['total_size'],
+        'human_total_size': format_file_size(row['total_size']),
+        'local_size': row['local_size'],
+        'human_local_size': format_file_size(row['local_size']),
+        'potential_savings': format_file_size(row['local_size'])
+    }
+
+def get_active_scan(onedrive_path, max_depth=None, conn=None):
+    """
+    Get the most recent active scan for a path
+    Args:
+        onedrive_path: Path to OneDrive folder
+        max_depth: Only match a scan made with this maximum depth (None for any)
+        conn: Open connection to use (a new one is opened when omitted)
+    Returns:
+        Row with id, scan_time, scan_params, stats and revision, or None if there is no active scan
+    """
+    scan_query = '''
+        SELECT id, scan_time, scan_params, stats, revision
+        FROM scan_results
+        WHERE onedrive_path = ? AND is_active = 1
+        '''
+    scan_params = [onedrive_path]
+    
+    if max_depth is not None:
+        scan_query += ' AND max_depth = ?'
+        scan_params.append(max_depth)
+    
+    with use_connection(conn) as conn:
+        return conn.execute(
+            scan_query + ' ORDER BY scan_time DESC LIMIT 1',
+            scan_params
+        ).fetchone()
+
+def encode_cursor(is_cloud_only, last_value, last_id):
+    """Encode the cloud-only flag, sort value and id of the last row on a page as an opaque cursor"""
+    if isinstance(last_value, datetime):
+        # Matches how sqlite3 stores TIMESTAMP values, so the comparison stays textual
+        last_value = str(last_value)
+    return base64.urlsafe_b64encode(json.dumps([is_cloud_only, last_value, last_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor, returning (is_cloud_only, last_value, last_id) or None if it is invalid"""
+    try:
+        is_cloud_only, last_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if is_cloud_only not in (0, 1) or isinstance(is_cloud_only, (bool, float)):
+        return None
+    # Only values that can be bound as parameters and compared with the sort columns;
+    # SQLite integers are 64-bit, so larger ones would fail only when the query runs
+    if isinstance(last_value, bool) or not isinstance(last_value, (str, int, float)):
+        return None
+    if isinstance(last_id, bool) or not isinstance(last_id, int):
+        return None
+    if any(isinstance(v, int) and not SQLITE_MIN_INTEGER <= v <= SQLITE_MAX_INTEGER
+           for v in (last_value, last_id)):
+        return None
+    return is_cloud_only, last_value, last_id
+
+def get_scan_results(onedrive_path, page=1, per_page=50, filters=None, sort_options=None, max_depth=None, cursor=None, conn=None):
     """
     Get paginated scan results from the database
     Args:
@@ -189,25 +481,23 @@ def get_scan_results(onedrive_path, page=1, per_page=50, filters=None, sort_opti
         per_page: Items per page
         filters: Dictionary with filter options
         sort_options: Dictionary with sorting options
+        max_depth: Only use a scan made with this maximum depth (None for any)
+        cursor: next_cursor of the previous page; when given, the page starts right
+            after that row instead of at (page - 1) * per_page
+        conn: Open connection to use (a new one is opened when omitted)
     Returns:
         Dictionary with:
             - files: List of file information for the current page
-            - pagination: Pagination details
+            - pagination: Pagination details, including next_cursor for the following page
             - stats: Scan statistics
             - last_scan_time: When the data was last scanned
+            - revision: Number of in-place updates made to the scan since it was stored
+            - scan_id: ID of the scan the page was read from
     """
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             # Get the most recent active scan for this path
-            scan_row = conn.execute(
-                '''
-                SELECT id, scan_time, stats
-                FROM scan_results
-                WHERE onedrive_path = ? AND is_active = 1
-                ORDER BY scan_time DESC LIMIT 1
-                ''',
-                (onedrive_path,)
-            ).fetchone()
+            scan_row = get_active_scan(onedrive_path, max_depth, conn=conn)
             
             if not scan_row:
                 print(f"No active scan found for {onedrive_path}")
@@ -250,45 +540,51 @@ def get_scan_results(onedrive_path, page=1, per_page=50, filters=None, sort_opti
             total_items = count_row['count'] if count_row else 0
             print(f"Total items: {total_items}")
             
-            # Add sorting
+            # Add sorting, falling back to size / descending for unknown values
+            column = 'size'
+            direction = 'desc'
             if sort_options:
                 column = sort_options.get('column', 'size')
                 direction = sort_options.get('direction', 'desc')
-                
-                # Map user-friendly column names to database columns
-                column_mapping = {
-                    'size': 'size',
-                    'name': 'name',
-                    'last_modified': 'last_modified'
-                }
-                
-                db_column = column_mapping.get(column, 'size')
-                
-                # Validate direction
-                if direction not in ('asc', 'desc'):
-                    direction = 'desc'
-                    
-                query += f' ORDER BY {db_column} {direction.upper()}'
-                
-                # Add secondary sort for consistency
-                if db_column != 'name':
-                    query += ', name ASC'
-            else:
-                # Default sorting
-                query += ' ORDER BY size DESC'
+            if column not in SORT_COLUMNS:
+                column = 'size'
+            if direction not in ('asc', 'desc'):
+                direction = 'desc'
             
-            # Add pagination
-            offset = (page - 1) * per_page
-            query += ' LIMIT ? OFFSET ?'
-            params.extend([per_page, offset])
+            db_column, order_by, seek_after = SORT_SQL[(column, direction)]
+            
+            # Fetch one extra row to know whether there is a next page
+            after = decode_cursor(cursor) if cursor else None
+            if after is None:
+                query += order_by + ' LIMIT ? OFFSET ?'
+                params.extend((per_page + 1, (page - 1) * per_page))
+            else:
+                # Seek past the last row of the previous page instead of using OFFSET, so
+                # every page costs the same no matter how deep it is. An OR across the
+                # cloud-only status could not seek, so the rest of the last row's status
+                # and the statuses after it are read as two range scans of the index.
+                is_cloud_only, last_value, last_id = after
+                query = (
+                    f'SELECT * FROM ({query} AND is_cloud_only = ?{seek_after}{order_by} LIMIT ?)'
+                    f' UNION ALL SELECT * FROM ({query} AND is_cloud_only > ?{order_by} LIMIT ?)'
+                    f'{order_by} LIMIT ?'
+                )
+                params = (params + [is_cloud_only, last_value, last_id, per_page + 1]
+                          + params + [is_cloud_only, per_page + 1, per_page + 1])
             
             print(f"SQL Query: {query}")
             print(f"Params: {params}")
             
             # Execute the query
             rows = conn.execute(query, params).fetchall()
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
             print(f"Found {len(rows)} rows for page {page}")
             
+            next_cursor = None
+            if has_next:
+                next_cursor = encode_cursor(rows[-1]['is_cloud_only'], rows[-1][db_column], rows[-1]['id'])
+            
             # Convert rows to dictionaries
             files = []
             for row in rows:
@@ -312,8 +608,9 @@ def get_scan_results(onedrive_path, page=1, per_page=50, filters=None, sort_opti
                 'per_page': per_page,
                 'total_files': total_items,
                 'total_pages': total_pages,
-                'has_next': page < total_pages,
-                'has_previous': page > 1
+                'has_next': has_next,
+                'has_previous': page > 1,
+                'next_cursor': next_cursor
             }
             
             print(f"Pagination: {pagination}")
@@ -322,27 +619,46 @@ def get_scan_results(onedrive_path, page=1, per_page=50, filters=None, sort_opti
                 'files': files,
                 'pagination': pagination,
                 'stats': stats,
-                'last_scan_time': last_scan_time
+                'last_scan_time': last_scan_time,
+                'revision': scan_row['revision'],
+                'scan_id': scan_id
             }
     except Exception as e:
         print(f"Error getting scan results from database: {e}")
         return None
 
-def clear_old_scans(days_to_keep=7):
-    """Delete scan results older than the specified number of days"""
-    with get_db_connection() as conn:
-        cutoff_time = datetime.now().timestamp() - (days_to_keep * 24 * 60 * 60)
-        conn.execute(
-            'DELETE FROM scan_results WHERE scan_time < ? AND is_active = 0',
-            (cutoff_time,)
-        )
-        conn.commit()
+def clear_old_scans(days_to_keep=7, conn=None):
+    """
+    Delete inactive scans older than the specified number of days, with their files
+    Args:
+        days_to_keep: Age in days past which inactive scans are deleted
+        conn: Open connection to use (a new one is opened when omitted)
+    Returns:
+        Number of scans deleted
+    """
+    with use_connection(conn) as conn:
+        # scan_time holds datetime values, so compare against one
+        cutoff_time = datetime.now() - timedelta(days=days_to_keep)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            scans_deleted = delete_scans(conn, 'scan_time < ? AND is_active = 0', (cutoff_time,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return scans_deleted
 
+@lru_cache(maxsize=4096)
 def format_file_size(size_bytes):
-    """Format file size in bytes to human-readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024 or unit == 'TB':
-            break
-        size_bytes /= 1024
+    """Format file size in bytes to human-readable format
+
+    Cached, as scans repeat the same sizes a lot (empty files, cloud placeholders,
+    identical copies) and pages format every row they return.
+    """
+    size_bytes = int(size_bytes)
+    if size_bytes <= 0:
+        return '0 B'
     
-    return f"{size_bytes:.1f} {unit}"
+    # Every unit is 2**10 times the previous one, so the bit length picks it directly
+    unit_index = min((size_bytes.bit_length() - 1) // 10, len(FILE_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (unit_index * 10)):.1f} {FILE_SIZE_UNITS[unit_index]}"
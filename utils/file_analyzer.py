@@ -1,60 +1,81 @@
 import os
 import re
+import logging
 import ctypes
-import subprocess
-from datetime import datetime
-import humanize
-import threading
-from concurrent.futures import ThreadPoolExecutor
+from ctypes import wintypes
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Per-file problems are logged at debug level with lazy %-formatting, so a scan
+# with logging at its default level does no message formatting or output per file
+logger = logging.getLogger(__name__)
+
+# Windows file attribute flags, mostly those used by OneDrive Files On-Demand
+FILE_ATTRIBUTE_DIRECTORY = 0x00000010
+FILE_ATTRIBUTE_REPARSE_POINT = 0x00000400
+FILE_ATTRIBUTE_OFFLINE = 0x00001000
+FILE_ATTRIBUTE_RECALL_ON_OPEN = 0x00040000
+FILE_ATTRIBUTE_PINNED = 0x00080000  # "Always keep on this device"
+FILE_ATTRIBUTE_UNPINNED = 0x00100000
+FILE_ATTRIBUTE_RECALL_ON_DATA_ACCESS = 0x00400000
+INVALID_FILE_ATTRIBUTES = 0xFFFFFFFF
+
+# Any of these flags means the file content is not (or will not stay) on disk
+CLOUD_ONLY_ATTRIBUTES = (
+    FILE_ATTRIBUTE_OFFLINE
+    | FILE_ATTRIBUTE_RECALL_ON_OPEN
+    | FILE_ATTRIBUTE_UNPINNED
+    | FILE_ATTRIBUTE_RECALL_ON_DATA_ACCESS
+)
+
+# Reparse tags of directory links (junctions and symbolic links). OneDrive
+# placeholders are reparse points too, but carry the cloud files tags instead.
+IO_REPARSE_TAG_MOUNT_POINT = 0xA0000003
+IO_REPARSE_TAG_SYMLINK = 0xA000000C
+LINK_REPARSE_TAGS = (IO_REPARSE_TAG_MOUNT_POINT, IO_REPARSE_TAG_SYMLINK)
+
+# The one kernel32 binding shared by the modules calling Win32 directly. Functions are
+# resolved once, so single-file checks skip the ctypes lookup and argument guessing,
+# and use_last_error lets failures report the Windows error code.
+if os.name == 'nt':
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+
+    GetFileAttributesW = kernel32.GetFileAttributesW
+    GetFileAttributesW.argtypes = [wintypes.LPCWSTR]
+    GetFileAttributesW.restype = wintypes.DWORD
+else:
+    kernel32 = GetFileAttributesW = None
+
+def is_directory_link(entry):
+    """
+    Check whether a directory entry is a junction or other link to another location.
+    Symbolic links are already excluded by is_dir(follow_symlinks=False); on Windows
+    this also catches junctions, which would otherwise be walked (and their targets
+    possibly hydrated). The check only reads the attributes cached by os.scandir.
+    """
+    if os.name != 'nt':
+        return False
+    stat_result = entry.stat(follow_symlinks=False)
+    return bool(stat_result.st_file_attributes & FILE_ATTRIBUTE_REPARSE_POINT) and \
+        stat_result.st_reparse_tag in LINK_REPARSE_TAGS
 
 def is_onedrive_cloud_only(file_path):
     """
-    More reliably determine if a OneDrive file is cloud-only.
-    Uses multiple approaches to increase accuracy.
+    Determine if a OneDrive file is cloud-only from its Windows file attributes.
+    The attribute bitmask from GetFileAttributesW is authoritative, so no
+    external commands or size heuristics are needed.
     """
-    # Windows API constants for file attributes
-    FILE_ATTRIBUTE_PINNED = 0x00080000
-    FILE_ATTRIBUTE_UNPINNED = 0x00100000
-    FILE_ATTRIBUTE_REPARSE_POINT = 0x00400000
+    if GetFileAttributesW is None:
+        return False
 
-    # Method 3: Check for reparse point attribute first (Based on log, this is most reliable)
-    try:
-        # Try to use ctypes to access Windows API
-        file_attributes = ctypes.windll.kernel32.GetFileAttributesW(file_path)
-        if file_attributes != 0xFFFFFFFF:  # INVALID_FILE_ATTRIBUTES
-            # Check for specific OneDrive reparse point attribute
-            if file_attributes & FILE_ATTRIBUTE_REPARSE_POINT:
-                return True
-            # Also check for FILE_ATTRIBUTE_UNPINNED
-            if file_attributes & FILE_ATTRIBUTE_UNPINNED:
-                return True
-    except Exception as e:
-        print(f"Method 3 failed: {str(e)}")
-    
-    # Method 1: Check file attributes using attrib command
-    try:
-        result = subprocess.run(['attrib', file_path], capture_output=True, text=True, timeout=3)
-        if result.returncode == 0:
-            output = result.stdout.strip()
-            # Check for 'U' (unpinned) attribute without 'P' (pinned) attribute
-            if 'U' in output and 'P' not in output:
-                print(f"Method 1 (attrib): File is cloud-only - {file_path}")
-                return True
-    except Exception as e:
-        print(f"Method 1 failed: {str(e)}")
-    
-    # Method 2: Check file size and reparse point status
-    try:
-        actual_size = os.path.getsize(file_path)
-        # Cloud-only files often have reparse points and very small size
-        # Changed from exact 0 to a small threshold to catch more cloud files
-        if os.path.isfile(file_path) and actual_size < 1024:  # Less than 1KB might be cloud-only
-            return True
-    except Exception as e:
-        print(f"Method 2 failed: {str(e)}")
-    
-    # If all methods indicate the file is not cloud-only, return False
-    return False
+    file_attributes = GetFileAttributesW(file_path)
+    return file_attributes != INVALID_FILE_ATTRIBUTES and bool(file_attributes & CLOUD_ONLY_ATTRIBUTES)
+
+# Everything between the OneDrive root folder (including a "OneDrive - Company"
+# suffix) and the file name; compiled once instead of on every call
+ONEDRIVE_FOLDER_PATTERN = re.compile(r'OneDrive(?:\s*-\s*[^\\\/]+)?[\\\/](.+)[\\\/][^\\\/]+$', re.IGNORECASE)
 
 def extract_folder_path(file_path, base_path=None):
     """
@@ -62,74 +83,156 @@ def extract_folder_path(file_path, base_path=None):
     """
     # If base_path is provided and file_path starts with it, get the relative path
     if base_path and file_path.startswith(base_path):
-        # Get just the folder part, excluding the filename
+        # Get just the folder part, excluding the filename. file_path was built
+        # from base_path, so slicing off the prefix gives the same result as
+        # os.path.relpath without normalizing and splitting both paths.
         folder_only = os.path.dirname(file_path)
-        rel_path = os.path.relpath(folder_only, base_path)
-        if rel_path and rel_path != '.':
-            return rel_path
+        base_length = len(base_path.rstrip('\\/'))
+        if len(folder_only) == base_length:
+            return ''  # Directly in base_path, an empty folder like getRelativePath gives
+        if folder_only[base_length:base_length + 1] in ('\\', '/'):
+            return folder_only[base_length + 1:]
     
     # Try to extract path after 'OneDrive'
     if 'OneDrive' in file_path:
         # Match everything after OneDrive (including company name if present)
-        match = re.search(r'OneDrive(?:\s*-\s*[^\\\/]+)?[\\\/](.+)[\\\/][^\\\/]+$', file_path, re.IGNORECASE)
+        match = ONEDRIVE_FOLDER_PATTERN.search(file_path)
         if match and match.group(1):
             return match.group(1)
     
     # Fallback to parent folder
     return os.path.basename(os.path.dirname(file_path))
 
-def get_file_attributes(file_path, base_path=None):
-    """Get file attributes including size and status (local or remote)"""
+class DirectoryContext(NamedTuple):
+    """Folder details shared by every file directly in one directory"""
+    parent_folder: str
+    relative_folder_path: str
+
+def get_directory_context(directory_path, base_path=None):
+    """Compute the folder details of a directory once for all of its files
+
+    Args:
+        directory_path: The directory being listed
+        base_path: Base path used to compute the relative folder path
+    """
+    # Built like os.scandir builds entry paths; the details only depend on the
+    # part before the file name, so any name gives the result every file would
+    child_path = os.path.join(directory_path, '_')
+    return DirectoryContext(
+        parent_folder=os.path.basename(os.path.dirname(child_path)),
+        relative_folder_path=extract_folder_path(child_path, base_path)
+    )
+
+def format_timestamp(timestamp):
+    """Format epoch seconds as a local 'YYYY-MM-DD HH:MM:SS' string
+
+    The scanner keeps modification times as the raw st_mtime floats and only
+    formats them where text is needed; time.strftime on a struct_time is much
+    cheaper than building a datetime for every file.
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+class FileInfo(NamedTuple):
+    """Information about one scanned file. Tuples are much smaller than dicts on
+    large scans; use _asdict() where a dict is needed, such as JSON responses."""
+    path: str
+    name: str
+    parent_folder: str
+    relative_folder_path: str
+    extension: str
+    size: int
+    is_cloud_only: bool
+    last_modified: Optional[float]  # Epoch seconds; see format_timestamp
+    error: Optional[str] = None
+
+class FileChange(NamedTuple):
+    """The attributes of a stored file that change without it being created,
+    deleted or moved, as re-read by get_file_changes"""
+    path: str
+    size: int
+    is_cloud_only: bool
+    last_modified: float  # Epoch seconds; see format_timestamp
+
+def get_file_attributes(entry, dir_context):
+    """Get file attributes including size and status (local or remote)
+
+    Args:
+        entry: os.DirEntry for the file, as returned by os.scandir
+        dir_context: DirectoryContext of the directory being listed
+    """
+    file_path = entry.path
     try:
-        # Get file size
-        file_size = os.path.getsize(file_path)
-        
-        # Use our more reliable function to check cloud status
-        is_cloud_only = is_onedrive_cloud_only(file_path)
-        
-        # Calculate last modified time
-        last_modified = os.path.getmtime(file_path)
-        modified_date = datetime.fromtimestamp(last_modified).strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Calculate file extension
-        _, ext = os.path.splitext(file_path)
-        ext = ext.lower() if ext else ''
+        # DirEntry.stat() reuses the metadata already returned by the directory
+        # listing where the platform provides it, so no extra syscall per file.
+        # follow_symlinks=False keeps it that way for links too, and shares the
+        # cached result with is_directory_link.
+        stat_result = entry.stat(follow_symlinks=False)
+        file_size = stat_result.st_size
         
-        # Get file name and parent folder
-        file_name = os.path.basename(file_path)
-        parent_folder = os.path.basename(os.path.dirname(file_path))
+        # On Windows the stat result carries the attributes from the directory
+        # listing, so the cloud status costs no extra GetFileAttributesW call
+        file_attributes = getattr(stat_result, 'st_file_attributes', 0)
+        is_cloud_only = bool(file_attributes & CLOUD_ONLY_ATTRIBUTES)
         
-        # Get relative folder path using our dedicated function
-        relative_folder_path = extract_folder_path(file_path, base_path)
+        # Get file name and its extension; rpartition on the bare name is much cheaper
+        # than os.path.splitext and, like it, ignores leading dots (".profile" has none)
+        file_name = entry.name
+        stem, dot, suffix = file_name.rpartition('.')
+        ext = (dot + suffix).lower() if stem.strip('.') else ''
         
-        # Humanize the file size
-        human_size = humanize.naturalsize(file_size)
-        
-        return {
-            'path': file_path,
-            'name': file_name,
-            'parent_folder': parent_folder,
-            'relative_folder_path': relative_folder_path,
-            'extension': ext,
-            'size': file_size,
-            'human_size': human_size,
-            'is_cloud_only': is_cloud_only,
-            'last_modified': modified_date
-        }
+        return FileInfo(
+            path=file_path,
+            name=file_name,
+            parent_folder=dir_context.parent_folder,
+            relative_folder_path=dir_context.relative_folder_path,
+            extension=ext,
+            size=file_size,
+            is_cloud_only=is_cloud_only,
+            last_modified=stat_result.st_mtime
+        )
     except Exception as e:
-        print(f"Error getting file attributes for {file_path}: {e}")
-        return {
-            'path': file_path,
-            'name': os.path.basename(file_path),
-            'parent_folder': os.path.basename(os.path.dirname(file_path)),
-            'relative_folder_path': os.path.basename(os.path.dirname(file_path)),
-            'extension': '',
-            'size': 0,
-            'human_size': '0 B',
-            'is_cloud_only': False,
-            'last_modified': '',
-            'error': str(e)
-        }
+        logger.debug("Error getting file attributes for %s: %s", file_path, e)
+        return FileInfo(
+            path=file_path,
+            name=entry.name,
+            parent_folder=dir_context.parent_folder,
+            relative_folder_path=dir_context.relative_folder_path,
+            extension='',
+            size=0,
+            is_cloud_only=False,
+            last_modified=None,
+            error=str(e)
+        )
+
+def get_file_changes(file_path):
+    """Re-read the mutable attributes of a file reported as changed
+
+    Args:
+        file_path: Full path of the file
+
+    Returns:
+        FileChange with the current attributes, or None if the file can no longer be read
+    """
+    try:
+        # Opening for attributes only does not hydrate cloud-only placeholders
+        stat_result = os.stat(file_path, follow_symlinks=False)
+    except OSError as e:
+        logger.debug("Error reading changed file %s: %s", file_path, e)
+        return None
+
+    return FileChange(
+        path=file_path,
+        size=stat_result.st_size,
+        is_cloud_only=bool(getattr(stat_result, 'st_file_attributes', 0) & CLOUD_ONLY_ATTRIBUTES),
+        last_modified=stat_result.st_mtime
+    )
+
+# Number of files the scanner collects before handing a batch to its consumer
+SCAN_BATCH_SIZE = 1000
+
+# The shared scan status is refreshed after this many files or seconds, whichever comes first
+STATUS_UPDATE_FILES = 128
+STATUS_UPDATE_INTERVAL = 0.1
 
 class DirectoryScanner:
     """Manages scanning of directories for file information"""
@@ -149,143 +252,189 @@ class DirectoryScanner:
             'last_updated': None
         }
 
-    def scan_directory(self, directory_path, max_depth=-1, current_depth=0, use_threads=True, max_workers=4):
-        """Recursively scan a directory and return file information
-        
+    def _scan_single_directory(self, directory_path, list_subdirectories, base_path):
+        """Scan one directory level and return its files and subdirectories
+
+        Args:
+            directory_path: The directory to list
+            list_subdirectories: Whether subdirectories should be returned for scanning;
+                False for directories at the depth limit, which then skip them entirely
+            base_path: Root of the scan, which folder paths are made relative to
+
+        Returns:
+            Tuple of (list of FileInfo tuples, list of subdirectory paths)
+        """
+        files_info = []
+        subdirectories = []
+
+        # Folder details are the same for every file here, so compute them once
+        dir_context = get_directory_context(directory_path, base_path)
+
+        # Bound once per directory rather than looked up again for every entry
+        add_file = files_info.append
+        add_subdirectory = subdirectories.append
+        read_file_attributes = get_file_attributes
+
+        try:
+            # Split the entries in one pass over the listing; the with block closes
+            # the directory handle as soon as the listing is done
+            with os.scandir(directory_path) as directory_entries:
+                for entry in directory_entries:
+                    # Only regular files and real directories are of interest: symlinks are
+                    # never followed, and directory links (junctions) are not descended into
+                    if entry.is_file(follow_symlinks=False):
+                        try:
+                            add_file(read_file_attributes(entry, dir_context))
+                        except Exception as e:
+                            logger.debug("Error processing file %s: %s", entry.path, e)
+                    elif list_subdirectories and entry.is_dir(follow_symlinks=False) and \
+                            not is_directory_link(entry):
+                        add_subdirectory(entry.path)
+        except Exception as e:
+            logger.warning("Error scanning directory %s: %s", directory_path, e)
+
+        return files_info, subdirectories
+
+    def iter_scan_batches(self, directory_path, max_depth=-1, use_threads=True, max_workers=32,
+                          batch_size=SCAN_BATCH_SIZE):
+        """Scan a directory tree and yield its file information in batches
+
+        Directories are handed out as independent tasks to a single thread pool:
+        each task lists one directory and returns its files together with the
+        subdirectories that still need scanning, which are queued as new tasks.
+        Every task builds its own result list, so workers never contend on a
+        shared list; the results are merged here as tasks complete.
+
+        Results are handed to the caller batch by batch, and no new directories are
+        submitted while the caller is consuming one, so memory stays bounded by the
+        batch size and in-flight tasks instead of growing with the whole tree.
+
         Args:
             directory_path: The path to scan
             max_depth: Maximum recursion depth (-1 for unlimited recursion)
-            current_depth: Current recursion depth
             use_threads: Whether to use threading for parallelism
             max_workers: Maximum number of worker threads
-            
-        Returns:
-            List of file information dictionaries
+            batch_size: Number of files collected before a batch is yielded
+
+        Yields:
+            Lists of FileInfo tuples
         """
         # Update scan status with current directory
         self.scan_status['current_directory'] = directory_path
-        self.scan_status['last_updated'] = datetime.now()
-        
-        # If this is the top level, estimate the total number of files
-        if current_depth == 0:
-            self.scan_status['status'] = 'Estimating total files...'
-            total_files_estimate = 0
-            
+        self.scan_status['last_updated'] = time.monotonic()
+
+        # There is no separate counting pass: the total is estimated while the scan
+        # runs, from the files seen so far and the directories still to list
+        total_estimate = 100
+        self.scan_status['total_estimate'] = total_estimate
+        self.scan_status['files_processed'] = 0
+        self.scan_status['status'] = 'Starting scan...'
+
+        # Progress is counted locally and copied to the shared status in STATUS_UPDATE_* steps
+        files_processed = 0
+        directories_scanned = 0
+        last_status_files = 0
+        last_status_time = time.monotonic()
+
+        batch = []
+        workers = max(1, max_workers) if use_threads else 1
+
+        # The depth limit is fixed for the whole scan, so resolve it once: directories
+        # below this depth are listed for files only and never look at their subdirectories
+        last_descending_depth = float('inf') if max_depth == -1 else max_depth - 1
+
+        # Directories waiting for a free worker, and the tasks currently in flight.
+        # Keeping at most a few tasks per worker in flight bounds the number of
+        # finished-but-unmerged results held in memory on very wide trees.
+        # The pending directories are used as a LIFO stack: the scan goes depth first,
+        # staying within one subtree (warm directory caches) and keeping the stack
+        # to the siblings along the current path instead of a whole tree level.
+        pending_directories = deque([(directory_path, 0)])
+        in_flight = {}
+        max_in_flight = workers * 2
+
+        # The final status is set however the scan ends, including when the caller
+        # stops consuming early and the generator is closed
+        error = None
+        finished = False
+        try:
             try:
-                # Quick estimation of file count (without full recursion)
-                for root, dirs, files in os.walk(directory_path):
-                    total_files_estimate += len(files)
-                    
-                    # Just check top level and a reasonable number of subdirectories for a rough estimate
-                    if len(dirs) > 30:
-                        dirs[:] = dirs[:30]  # Increase subdirectory limit for better estimation
-                    
-                    # Break after reasonable estimation to avoid long initial delay
-                    if total_files_estimate > 5000:
-                        break
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    while pending_directories or in_flight:
+                        while pending_directories and len(in_flight) < max_in_flight:
+                            path, depth = pending_directories.pop()
+                            future = executor.submit(self._scan_single_directory, path, depth <= last_descending_depth,
+                                                     directory_path)
+                            in_flight[future] = (path, depth)
+
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            path, depth = in_flight.pop(future)
+                            directory_files, subdirectories = future.result()
+
+                            batch.extend(directory_files)
+                            pending_directories.extend((subdir, depth + 1) for subdir in subdirectories)
+                            files_processed += len(directory_files)
+                            directories_scanned += 1
+
+                        # Publish progress every few hundred files or tenth of a second
+                        # rather than after every directory
+                        now = time.monotonic()
+                        if files_processed - last_status_files >= STATUS_UPDATE_FILES or \
+                                now - last_status_time >= STATUS_UPDATE_INTERVAL:
+                            # Assume the directories still waiting hold as many files as the average so far
+                            directories_remaining = len(pending_directories) + len(in_flight)
+                            total_estimate = max(total_estimate,
+                                                 files_processed + directories_remaining * files_processed // directories_scanned)
+                            self.scan_status.update(
+                                files_processed=files_processed,
+                                total_estimate=total_estimate,
+                                current_directory=path,
+                                status=f"Processing file {files_processed} of ~{total_estimate}",
+                                last_updated=now
+                            )
+                            last_status_files, last_status_time = files_processed, now
+
+                        if len(batch) >= batch_size:
+                            yield batch
+                            batch = []
             except Exception as e:
-                print(f"Error estimating file count: {e}")
-                total_files_estimate = 100  # Default estimate
-            
-            self.scan_status['total_estimate'] = max(100, total_files_estimate)
-            self.scan_status['files_processed'] = 0
-            self.scan_status['status'] = 'Starting scan...'
-        
-        # List to store file information
-        files_info = []
-        
-        try:
-            # Get all entries in the current directory
-            entries = list(os.scandir(directory_path))
-            
-            # Process files in the current directory
-            file_entries = [e for e in entries if e.is_file()]
-            dir_entries = [e for e in entries if e.is_dir()]
-            
-            # Process files (can be parallelized)
-            if use_threads and len(file_entries) > 10 and current_depth == 0:  # Only use threads for large directories at top level
-                # Create a ThreadPoolExecutor to process files in parallel
-                self.scan_status['status'] = f"Processing {len(file_entries)} files with {max_workers} threads..."
-                
-                # Define a worker function to process a batch of files
-                def process_file_batch(batch):
-                    batch_results = []
-                    for i, entry in enumerate(batch):
-                        self.scan_status['current_directory'] = entry.path
-                        try:
-                            file_info = get_file_attributes(entry.path, directory_path)
-                            batch_results.append(file_info)
-                            # Update processed count (thread-safe through atomic operations)
-                            self.scan_status['files_processed'] += 1
-                        except Exception as e:
-                            print(f"Error processing file {entry.path}: {e}")
-                    return batch_results
-                
-                # Split files into batches for each worker
-                batch_size = max(1, len(file_entries) // max_workers)
-                batches = [file_entries[i:i + batch_size] for i in range(0, len(file_entries), batch_size)]
-                
-                # Process batches in parallel
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    batch_results = list(executor.map(process_file_batch, batches))
-                
-                # Flatten the results
-                for batch in batch_results:
-                    files_info.extend(batch)
+                error = e
+                logger.warning("Error scanning directory %s: %s", directory_path, e)
+
+            if batch:
+                yield batch
+            finished = True
+        finally:
+            if error is not None:
+                status = f"Error: {str(error)}"
+            elif finished:
+                status = 'Scan complete'
             else:
-                # Process files sequentially
-                for i, entry in enumerate(file_entries):
-                    # Update progress indication
-                    progress_pct = (i / len(entries)) * 100 if entries else 0
-                    self.scan_status['progress'] = progress_pct
-                    
-                    self.scan_status['status'] = f"Processing file {self.scan_status['files_processed'] + 1} of ~{self.scan_status['total_estimate']}"
-                    self.scan_status['current_directory'] = entry.path
-                    
-                    try:
-                        file_info = get_file_attributes(entry.path, directory_path)
-                        files_info.append(file_info)
-                        self.scan_status['files_processed'] += 1
-                    except Exception as e:
-                        print(f"Error processing file {entry.path}: {e}")
-            
-            # Process subdirectories (can be done in parallel for deeper levels)
-            if max_depth == -1 or current_depth < max_depth:  # Fixed condition for unlimited depth
-                if use_threads and len(dir_entries) > 4 and (max_depth == -1 or current_depth < 5):  # Allow threading for deeper levels
-                    self.scan_status['status'] = f"Scanning {len(dir_entries)} subdirectories in parallel..."
-                    
-                    # Define a worker function to scan a directory
-                    def scan_subdir(entry):
-                        self.scan_status['current_directory'] = entry.path
-                        try:
-                            return self.scan_directory(entry.path, max_depth, current_depth + 1, use_threads, max_workers)
-                        except Exception as e:
-                            print(f"Error scanning subdirectory {entry.path}: {e}")
-                            return []
-                    
-                    # Scan subdirectories in parallel with limited concurrency
-                    concurrent_dirs = min(len(dir_entries), max_workers)
-                    with ThreadPoolExecutor(max_workers=concurrent_dirs) as executor:
-                        subdir_results = list(executor.map(scan_subdir, dir_entries))
-                    
-                    # Flatten the results from all subdirectories
-                    for subdir_files in subdir_results:
-                        files_info.extend(subdir_files)
-                else:
-                    # Process subdirectories sequentially
-                    for entry in dir_entries:
-                        self.scan_status['status'] = f"Scanning folder: {os.path.basename(entry.path)}"
-                        self.scan_status['current_directory'] = entry.path
-                        
-                        sub_files = self.scan_directory(entry.path, max_depth, current_depth + 1, use_threads, max_workers)
-                        files_info.extend(sub_files)
-        except Exception as e:
-            self.scan_status['status'] = f"Error: {str(e)}"
-            print(f"Error scanning directory {directory_path}: {e}")
-        
-        # Update completion status if we're at the top level
-        if current_depth == 0:
-            self.scan_status['status'] = 'Scan complete'
-            self.scan_status['progress'] = 100
-        
-        return files_info
\ No newline at end of file
+                status = 'Scan stopped'
+
+            # The walk is over, so the count is now exact
+            self.scan_status.update(
+                files_processed=files_processed,
+                total_estimate=files_processed,
+                status=status,
+                progress=100,
+                last_updated=time.monotonic()
+            )
+
+    def scan_directory(self, directory_path, max_depth=-1, use_threads=True, max_workers=32):
+        """Scan a directory tree and return all file information as one list
+
+        Args:
+            directory_path: The path to scan
+            max_depth: Maximum recursion depth (-1 for unlimited recursion)
+            use_threads: Whether to use threading for parallelism
+            max_workers: Maximum number of worker threads
+
+        Returns:
+            List of FileInfo tuples
+        """
+        files_info = []
+        for batch in self.iter_scan_batches(directory_path, max_depth, use_threads, max_workers):
+            files_info.extend(batch)
+        return files_info
@@ -1,88 +1,55 @@
-import os
-import time
-import subprocess
-from .file_analyzer import is_onedrive_cloud_only
+import logging
+import ctypes
+from ctypes import wintypes
+from .file_analyzer import (
+    is_onedrive_cloud_only,
+    kernel32,
+    GetFileAttributesW,
+    FILE_ATTRIBUTE_PINNED,
+    FILE_ATTRIBUTE_UNPINNED,
+    INVALID_FILE_ATTRIBUTES,
+)
+
+logger = logging.getLogger(__name__)
+
+if kernel32 is not None:
+    _SetFileAttributesW = kernel32.SetFileAttributesW
+    _SetFileAttributesW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD]
+    _SetFileAttributesW.restype = wintypes.BOOL
+else:
+    _SetFileAttributesW = None
 
 def make_file_cloud_only(file_path):
     """
-    Make a file cloud-only using multiple methods to ensure success.
-    Returns a tuple (success, message)
+    Make a file cloud-only by marking it unpinned, the same change as
+    "Free up space" in Explorer or `attrib +U -P`. OneDrive then drops the
+    local copy in the background; the call itself returns immediately.
+    Returns a tuple (success, message, is_cloud_only), where is_cloud_only is the
+    file status observed by the last check, so callers need not query it again
     """
-    print(f"Attempting to make cloud-only: {file_path}")
-    
+    if _SetFileAttributesW is None:
+        return (False, "Making files cloud-only is only supported on Windows", False)
+
     # Check if file already cloud-only
     if is_onedrive_cloud_only(file_path):
-        return (True, "File is already cloud-only")
-    
-    # Method 1: Use the attrib command with additional options
-    try:
-        # Run the command with more verbose output
-        print(f"Running attrib +U -P on {file_path}")
-        result = subprocess.run(['attrib', '+U', '-P', file_path], 
-                               capture_output=True, text=True, timeout=10)
-        
-        print(f"Attrib command output: {result.stdout}")
-        print(f"Attrib command error: {result.stderr}")
-        
-        if result.returncode == 0:
-            # Wait a moment for OneDrive to process the change
-            time.sleep(2)
-            
-            # Verify the change worked
-            if is_onedrive_cloud_only(file_path):
-                return (True, "Successfully made file cloud-only with attrib command")
-            else:
-                print("Attrib command returned success but file is still not cloud-only")
-        else:
-            print(f"Attrib command failed with return code: {result.returncode}")
-    except Exception as e:
-        print(f"Exception with attrib command: {str(e)}")
-    
-    # Method 2: Use PowerShell with FileSystem.IO method
-    try:
-        print("Trying PowerShell method...")
-        # Use the FileSystem.IO method which might be more reliable
-        ps_command = f'powershell -Command "& {{$item = Get-Item \"{file_path}\"; $attribs = [System.IO.FileAttributes]::Archive -bor [System.IO.FileAttributes]::Offline; Set-ItemProperty -Path \"{file_path}\" -Name Attributes -Value $attribs; Write-Output \"PowerShell attributes set\"}}"'
-        
-        result = subprocess.run(ps_command, shell=True, capture_output=True, text=True, timeout=15)
-        print(f"PowerShell output: {result.stdout}")
-        print(f"PowerShell error: {result.stderr}")
-        
-        # Wait a moment for OneDrive to process the change
-        time.sleep(2)
-        
-        # Verify the change worked
-        if is_onedrive_cloud_only(file_path):
-            return (True, "Successfully made file cloud-only with PowerShell FileSystem.IO")
-    except Exception as e:
-        print(f"Exception with PowerShell FileSystem.IO method: {str(e)}")
-    
-    # Method 3: Try using OneDrive's built-in free up space command via PowerShell
-    try:
-        print("Trying OneDrive FreeSpace method...")
-        # This uses OneDrive's own functionality to free up space
-        # The exact command might depend on your OneDrive version
-        ps_command = f'powershell -Command "& {{$folder = Split-Path \"{file_path}\"; Start-Process \"$env:LOCALAPPDATA\Microsoft\OneDrive\OneDrive.exe\" -ArgumentList \"/FreeSpace:`$folder\"}}"'
-        
-        result = subprocess.run(ps_command, shell=True, timeout=15)
-        
-        # OneDrive might take a while to process this
-        print("Waiting for OneDrive to process the free space command...")
-        time.sleep(5)
-        
-        # Verify the change worked
-        if is_onedrive_cloud_only(file_path):
-            return (True, "Successfully made file cloud-only with OneDrive FreeSpace command")
-    except Exception as e:
-        print(f"Exception with OneDrive FreeSpace method: {str(e)}")
-    
-    # If we're here, all methods failed
-    # Return more detailed error information
-    error_message = "Failed to make file cloud-only after multiple attempts. Check if:"
-    error_message += "\n- You have sufficient permissions"
-    error_message += "\n- The file is not currently in use"
-    error_message += "\n- OneDrive sync is working properly"
-    error_message += "\n- The file is part of a synced OneDrive folder"
-    
-    print(error_message)
-    return (False, error_message)
+        return (True, "File is already cloud-only", True)
+
+    file_attributes = GetFileAttributesW(file_path)
+    if file_attributes == INVALID_FILE_ATTRIBUTES:
+        error = ctypes.WinError(ctypes.get_last_error())
+        logger.warning("Failed to read attributes of %s: %s", file_path, error)
+        return (False, f"Failed to read file attributes: {error.strerror}", False)
+
+    # Unpin and drop "always keep on this device" in a single attribute write
+    new_attributes = (file_attributes | FILE_ATTRIBUTE_UNPINNED) & ~FILE_ATTRIBUTE_PINNED
+    if not _SetFileAttributesW(file_path, new_attributes):
+        error = ctypes.WinError(ctypes.get_last_error())
+        logger.warning("Failed to make %s cloud-only: %s", file_path, error)
+
+        error_message = f"Failed to make file cloud-only ({error.strerror}). Check if:"
+        error_message += "\n- You have sufficient permissions"
+        error_message += "\n- The file is not currently in use"
+        error_message += "\n- The file is part of a synced OneDrive folder"
+        return (False, error_message, False)
+
+    return (True, "File marked as cloud-only, OneDrive will free its local copy", is_onedrive_cloud_only(file_path))
@@ -0,0 +1,270 @@
+"""
+NTFS change journal (USN journal) access for incremental OneDrive scans
+
+A full scan records the journal position of the volume it ran on. When the
+stored scan goes stale, the records written since then tell which files
+changed, so only those need to be looked at again instead of the whole tree.
+"""
+import os
+import ctypes
+import struct
+from ctypes import wintypes
+
+from .file_analyzer import FILE_ATTRIBUTE_DIRECTORY, kernel32
+
+FSCTL_QUERY_USN_JOURNAL = 0x000900F4
+FSCTL_READ_USN_JOURNAL = 0x000900BB
+
+GENERIC_READ = 0x80000000
+FILE_READ_ATTRIBUTES = 0x00000080
+FILE_SHARE_ALL = 0x00000001 | 0x00000002 | 0x00000004  # read, write and delete
+OPEN_EXISTING = 3
+FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+# Reasons that add, remove or move entries; the stored scan cannot be patched for
+# these (new files are unknown to it), so they require a full rescan
+USN_REASON_FILE_CREATE = 0x00000100
+USN_REASON_FILE_DELETE = 0x00000200
+USN_REASON_RENAME_OLD_NAME = 0x00001000
+USN_REASON_RENAME_NEW_NAME = 0x00002000
+STRUCTURAL_CHANGE_REASONS = (
+    USN_REASON_FILE_CREATE
+    | USN_REASON_FILE_DELETE
+    | USN_REASON_RENAME_OLD_NAME
+    | USN_REASON_RENAME_NEW_NAME
+)
+
+# Size of the buffer each FSCTL_READ_USN_JOURNAL call fills with records
+READ_BUFFER_SIZE = 64 * 1024
+
+# The journal covers the whole volume, and resolving a parent directory costs an
+# OpenFileById and a GetFinalPathNameByHandleW. Past these limits a refresh could
+# cost more than rescanning, so a full rescan is requested instead.
+MAX_JOURNAL_RECORDS = 100000
+MAX_DIRECTORY_LOOKUPS = 2000
+
+
+class FILE_ID_DESCRIPTOR(ctypes.Structure):
+    """FILE_ID_DESCRIPTOR for OpenFileById, using the 64-bit FileIdType member of the union"""
+    _fields_ = [
+        ('dwSize', wintypes.DWORD),
+        ('Type', ctypes.c_int),
+        ('FileId', ctypes.c_longlong),
+        ('_reserved', ctypes.c_ubyte * 8),  # rest of the union (FILE_ID_128)
+    ]
+
+
+if kernel32 is not None:
+    _CreateFileW = kernel32.CreateFileW
+    _CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                             wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE]
+    _CreateFileW.restype = wintypes.HANDLE
+
+    _OpenFileById = kernel32.OpenFileById
+    _OpenFileById.argtypes = [wintypes.HANDLE, ctypes.POINTER(FILE_ID_DESCRIPTOR), wintypes.DWORD,
+                              wintypes.DWORD, wintypes.LPVOID, wintypes.DWORD]
+    _OpenFileById.restype = wintypes.HANDLE
+
+    _DeviceIoControl = kernel32.DeviceIoControl
+    _DeviceIoControl.argtypes = [wintypes.HANDLE, wintypes.DWORD, wintypes.LPVOID, wintypes.DWORD,
+                                 wintypes.LPVOID, wintypes.DWORD, ctypes.POINTER(wintypes.DWORD),
+                                 wintypes.LPVOID]
+    _DeviceIoControl.restype = wintypes.BOOL
+
+    _GetFinalPathNameByHandleW = kernel32.GetFinalPathNameByHandleW
+    _GetFinalPathNameByHandleW.argtypes = [wintypes.HANDLE, wintypes.LPWSTR, wintypes.DWORD, wintypes.DWORD]
+    _GetFinalPathNameByHandleW.restype = wintypes.DWORD
+
+    _CloseHandle = kernel32.CloseHandle
+    _CloseHandle.argtypes = [wintypes.HANDLE]
+    _CloseHandle.restype = wintypes.BOOL
+
+
+def _open_volume(path):
+    """Open the volume holding path for journal queries, or return None"""
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    if not drive.endswith(':'):
+        return None  # UNC paths have no local change journal
+
+    handle = _CreateFileW(f'\\\\.\\{drive}', GENERIC_READ, FILE_SHARE_ALL, None, OPEN_EXISTING, 0, None)
+    if handle in (None, INVALID_HANDLE_VALUE):
+        return None
+    return handle
+
+
+def _query_journal(volume_handle):
+    """Return (journal_id, first_usn, next_usn) of the volume's journal, or None"""
+    output = ctypes.create_string_buffer(64)  # USN_JOURNAL_DATA_V0 is 56 bytes
+    returned = wintypes.DWORD()
+    if not _DeviceIoControl(volume_handle, FSCTL_QUERY_USN_JOURNAL, None, 0,
+                            output, len(output), ctypes.byref(returned), None):
+        return None
+    return struct.unpack_from('<Qqq', output.raw)
+
+
+def _final_path(handle):
+    """Return the normalized path of an open handle, without the \\\\?\\ prefix, or None"""
+    buffer = ctypes.create_unicode_buffer(32768)
+    length = _GetFinalPathNameByHandleW(handle, buffer, len(buffer), 0)
+    if not length or length >= len(buffer):
+        return None
+    path = buffer.value
+    if path.startswith('\\\\?\\UNC\\'):
+        return '\\\\' + path[8:]
+    if path.startswith('\\\\?\\'):
+        return path[4:]
+    return path
+
+
+def _directory_path_by_id(volume_handle, file_id):
+    """Resolve a directory's file reference number to its current path, or None if it is gone"""
+    descriptor = FILE_ID_DESCRIPTOR(dwSize=ctypes.sizeof(FILE_ID_DESCRIPTOR), Type=0, FileId=file_id)
+    handle = _OpenFileById(volume_handle, ctypes.byref(descriptor), FILE_READ_ATTRIBUTES,
+                           FILE_SHARE_ALL, None, FILE_FLAG_BACKUP_SEMANTICS)
+    if handle in (None, INVALID_HANDLE_VALUE):
+        return None
+    try:
+        return _final_path(handle)
+    finally:
+        _CloseHandle(handle)
+
+
+def _resolved_root(root):
+    """Return root as the final path the journal records will resolve to, or None"""
+    handle = _CreateFileW(root, FILE_READ_ATTRIBUTES, FILE_SHARE_ALL, None,
+                          OPEN_EXISTING, FILE_FLAG_BACKUP_SEMANTICS, None)
+    if handle in (None, INVALID_HANDLE_VALUE):
+        return None
+    try:
+        return _final_path(handle)
+    finally:
+        _CloseHandle(handle)
+
+
+def query_journal_cursor(path):
+    """
+    Get the current change journal position of the volume holding path.
+    Returns a JSON-serializable cursor dict, or None when the journal cannot be
+    read (not Windows, not NTFS, no journal, or insufficient privileges).
+    """
+    if os.name != 'nt':
+        return None
+
+    volume_handle = _open_volume(path)
+    if volume_handle is None:
+        return None
+    try:
+        journal = _query_journal(volume_handle)
+        if journal is None:
+            return None
+        journal_id, _, next_usn = journal
+        return {'journal_id': journal_id, 'next_usn': next_usn}
+    finally:
+        _CloseHandle(volume_handle)
+
+
+def read_changed_files(root, cursor):
+    """
+    Read which files under root changed since cursor was taken.
+
+    Args:
+        root: The scanned directory, as it is stored with the scan
+        cursor: Cursor returned by query_journal_cursor when the scan started
+
+    Returns:
+        Tuple (set of changed file paths, new cursor), with paths built on root the
+        same way the scanner builds them. None when the stored scan cannot be
+        patched and a full rescan is needed: the journal is unavailable, was
+        recreated or has wrapped past the cursor, stops making progress, holds
+        more changes than a refresh is worth (MAX_JOURNAL_RECORDS,
+        MAX_DIRECTORY_LOOKUPS), or entries under root were created, deleted or renamed.
+    """
+    if os.name != 'nt' or not cursor:
+        return None
+
+    resolved_root = _resolved_root(root)
+    volume_handle = _open_volume(root)
+    if resolved_root is None or volume_handle is None:
+        if volume_handle is not None:
+            _CloseHandle(volume_handle)
+        return None
+
+    root_prefix = os.path.normcase(resolved_root).rstrip('\\') + '\\'
+
+    try:
+        journal = _query_journal(volume_handle)
+        if journal is None:
+            return None
+        journal_id, first_usn, end_usn = journal
+
+        # A new journal or records already purged past our position: changes were lost
+        if journal_id != cursor['journal_id'] or cursor['next_usn'] < first_usn:
+            return None
+
+        directory_paths = {}
+        changed_files = set()
+        records_read = 0
+        buffer = ctypes.create_string_buffer(READ_BUFFER_SIZE)
+        returned = wintypes.DWORD()
+        usn = cursor['next_usn']
+
+        while usn < end_usn:
+            # READ_USN_JOURNAL_DATA_V0: StartUsn, ReasonMask, ReturnOnlyOnClose,
+            # Timeout, BytesToWaitFor (0 = do not wait), UsnJournalID
+            read_data = struct.pack('<qIIQQQ', usn, 0xFFFFFFFF, 0, 0, 0, journal_id)
+            if not _DeviceIoControl(volume_handle, FSCTL_READ_USN_JOURNAL, read_data, len(read_data),
+                                    buffer, len(buffer), ctypes.byref(returned), None):
+                return None
+
+            data = buffer.raw[:returned.value]
+            next_usn = struct.unpack_from('<q', data)[0]
+            offset = 8
+
+            while offset < len(data):
+                record_length, major_version = struct.unpack_from('<IH', data, offset)
+                if major_version != 2:
+                    return None  # USN_RECORD_V3 (128-bit file ids, ReFS) is not supported
+                (_, parent_id, record_usn, _, reason, _, _,
+                 attributes, name_length, name_offset) = struct.unpack_from('<QQqqIIIIHH', data, offset + 8)
+                name = data[offset + name_offset:offset + name_offset + name_length].decode('utf-16-le')
+                offset += record_length
+
+                records_read += 1
+                if records_read > MAX_JOURNAL_RECORDS:
+                    return None
+
+                # Later records are picked up by the next refresh
+                if record_usn >= end_usn:
+                    continue
+
+                if parent_id not in directory_paths:
+                    if len(directory_paths) >= MAX_DIRECTORY_LOOKUPS:
+                        return None
+                    directory_paths[parent_id] = _directory_path_by_id(volume_handle, parent_id)
+                parent_path = directory_paths[parent_id]
+
+                # A parent that no longer exists was itself deleted or moved; if it was
+                # under root, that shows up as a structural change of an ancestor
+                if parent_path is None:
+                    continue
+
+                full_path = os.path.join(parent_path, name)
+                if not os.path.normcase(full_path).startswith(root_prefix):
+                    continue
+
+                if reason & STRUCTURAL_CHANGE_REASONS:
+                    return None
+
+                if not attributes & FILE_ATTRIBUTE_DIRECTORY:
+                    changed_files.add(os.path.join(root, full_path[len(root_prefix):]))
+
+            # No progress before end_usn: the records left unread would be lost
+            # if the cursor moved past them
+            if next_usn <= usn:
+                return None
+            usn = next_usn
+
+        return changed_files, {'journal_id': journal_id, 'next_usn': end_usn}
+    finally:
+        _CloseHandle(volume_handle)